@@ -1,10 +1,16 @@
 ﻿from __future__ import annotations
 
+import json
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 import yaml
 
+try:
+    from yaml import CSafeLoader as _Loader  # libyaml
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
 
 @dataclass(frozen=True)
 class Source:
@@ -15,9 +21,31 @@ class Source:
     meta: Dict[str, Any] = None
 
 
-def load_sources(path: str | Path) -> List[Source]:
+def load_yaml_cached(path: str | Path) -> Any:
+    """
+    Parse a YAML file, reusing a JSON sidecar (<name>.yaml.json) as long as
+    it is not older than the YAML itself.
+    """
     p = Path(path)
-    data = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
+    cache = p.with_suffix(p.suffix + ".json")
+    try:
+        if cache.stat().st_mtime_ns >= p.stat().st_mtime_ns:
+            return json.loads(cache.read_bytes())
+    except (OSError, ValueError):
+        pass
+
+    # raw bytes straight into libyaml: it detects the encoding (and BOM) itself
+    data = yaml.load(p.read_bytes(), Loader=_Loader)
+    try:
+        cache.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    except (OSError, TypeError):
+        # read-only checkout or non-JSON types (dates); just skip the cache
+        pass
+    return data
+
+
+def load_sources(path: str | Path) -> List[Source]:
+    data = load_yaml_cached(path) or {}
     items = data.get("sources", [])
     out: List[Source] = []
     for s in items:
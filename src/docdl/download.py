@@ -1,28 +1,81 @@
 ﻿
 from __future__ import annotations
+import asyncio
 import hashlib
+import random
+from dataclasses import dataclass
 from pathlib import Path
 import httpx
-from .http import fetch, RateLimiter, HttpConfig
+from .http import RateLimiter, HttpConfig
+
+CHUNK_SIZE = 64 * 1024
 
 class PaywallOrHtmlError(RuntimeError):
     pass
 
+@dataclass(frozen=True)
+class DownloadResult:
+    path: Path
+    pdf_hash: str  # sha256 of the raw PDF bytes
+
 def stable_pdf_filename(source_id: str, pdf_url: str) -> str:
-    h = hashlib.sha256(pdf_url.encode("utf-8")).hexdigest()[:12]
+    # 6-byte BLAKE2b gives the 12 hex chars directly; this is a filename tag,
+    # not a security boundary. (Names changed from sha256[:12] in 0.2.0.)
+    h = hashlib.blake2b(pdf_url.encode("utf-8"), digest_size=6).hexdigest()
     return f"{source_id}_{h}.pdf"
 
-def download_pdf(source_id: str, pdf_url: str, out_dir: Path, *, cfg: HttpConfig) -> Path:
+async def download_pdf(client: httpx.AsyncClient, rl: RateLimiter, source_id: str, pdf_url: str, out_dir: Path, *, cfg: HttpConfig) -> DownloadResult:
     out_dir.mkdir(parents=True, exist_ok=True)
     path = out_dir / stable_pdf_filename(source_id, pdf_url)
+    part = path.with_name(path.name + ".part")
+
+    headers = {"User-Agent": cfg.user_agent}
+    last_exc = None
+
+    # Paywall probe: a successful HEAD that answers with HTML means the GET
+    # is never issued. Anything else (405/501 from CDNs that reject HEAD,
+    # errors, network failures) falls through to the GET, which re-checks.
+    await rl.wait_async(pdf_url)
+    try:
+        head = await client.head(pdf_url, headers=headers, timeout=cfg.timeout_s, follow_redirects=True)
+    except httpx.HTTPError:
+        head = None
+    if head is not None and head.is_success:
+        if "text/html" in (head.headers.get("content-type") or "").lower():
+            raise PaywallOrHtmlError(f"Got HTML instead of PDF for {pdf_url}")
+
+    # Same retry/backoff policy as fetch_async, but the body is streamed to
+    # disk in chunks instead of being buffered in memory.
+    for attempt in range(cfg.max_retries + 1):
+        try:
+            await rl.wait_async(pdf_url)
+            async with client.stream(
+                "GET", pdf_url, headers=headers, timeout=cfg.timeout_s, follow_redirects=True
+            ) as resp:
+                if resp.status_code in cfg.backoff_statuses:
+                    await asyncio.sleep((2 ** attempt) + random.random())
+                    continue
+
+                # check before consuming the body
+                ctype = (resp.headers.get("content-type") or "").lower()
+                if "text/html" in ctype:
+                    raise PaywallOrHtmlError(f"Got HTML instead of PDF for {pdf_url}")
+
+                # hash while writing: the PDF is never re-read for pdf_hash
+                h = hashlib.sha256()
+                with part.open("wb") as f:
+                    async for chunk in resp.aiter_bytes(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        h.update(chunk)
 
-    rl = RateLimiter(cfg.rps_per_domain)
-    with httpx.Client(http2=True) as client:
-        resp = fetch(client, rl, pdf_url, cfg=cfg)
+            part.replace(path)
+            return DownloadResult(path=path, pdf_hash=h.hexdigest())
 
-    ctype = (resp.headers.get("content-type") or "").lower()
-    if "text/html" in ctype:
-        raise PaywallOrHtmlError(f"Got HTML instead of PDF for {pdf_url}")
+        except PaywallOrHtmlError:
+            raise
+        except Exception as e:
+            last_exc = e
+            part.unlink(missing_ok=True)
+            await asyncio.sleep((2 ** attempt) + random.random())
 
-    path.write_bytes(resp.content)
-    return path
+    raise RuntimeError(f"Failed to download after retries: {pdf_url}. Last error: {last_exc}")
@@ -1,63 +1,300 @@
 ﻿from __future__ import annotations
 import os
-import json
+import random
+import threading
+import time
 import httpx
 from typing import Any
 
+from .util import json_dumps, json_loads
+
+# Reintentables: rate limit y errores transitorios del proveedor
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Tope de espera entre reintentos, también para un Retry-After del servidor
+MAX_RETRY_DELAY_S = 30
+
+# Errores en los que la petición no llegó a enviarse: reintentar no duplica nada
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Un único cliente para todo el módulo: los reintentos y el batch reutilizan
+# la conexión TLS en lugar de abrir una nueva por petición. Se crea al primer
+# uso, no al importar (los workers de extracción importan este módulo)
+_client: httpx.Client | None = None
+_client_lock = threading.Lock()
+
+def _get_client() -> httpx.Client:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(timeout=90)
+        return _client
+
+class BatchPendingError(RuntimeError):
+    """El batch sigue en curso al vencer el timeout de poll_batch (no está perdido)."""
+    def __init__(self, batch_id: str, status: str | None):
+        super().__init__(f"OpenAI batch {batch_id} still {status}")
+        self.batch_id = batch_id
+
+class BatchFailedError(RuntimeError):
+    """El batch terminó en failed/expired/cancelled: no queda nada que recoger."""
+    def __init__(self, batch_id: str, status: str):
+        super().__init__(f"OpenAI batch {batch_id} ended with status {status}")
+        self.batch_id = batch_id
+
 def _openai_headers() -> dict[str, str]:
     return {
         "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}",
         "Content-Type": "application/json",
     }
 
-def summarize_report(text: str, *, title: str, source: str) -> dict[str, Any]:
+def _base_url() -> str:
+    return os.environ.get("OPENAI_BASE_URL", "https://api.openai.com").rstrip("/")
+
+# El modelo solo necesita la señal: recortamos el texto y acotamos la salida
+MAX_INPUT_CHARS = 60_000
+MAX_OUTPUT_TOKENS = 1500
+
+# El esquema va una sola vez en response_format (strict); el system queda corto
+SYSTEM_PROMPT = (
+    "You are a senior economic and energy analyst. "
+    "Summarize and extract structured signals from the report text. "
+    "Return JSON with keys: summary (120-200 words, neutral, dense), key_points (6-10), "
+    "key_numbers, topics, countries, dates, impact_level, confidence (0-1). "
+    "Only clearly stated numbers; never invent data; lower confidence when unsure."
+)
+
+_STR = {"type": "string"}
+_STR_OR_NULL = {"type": ["string", "null"]}
+
+REPORT_SCHEMA: dict[str, Any] = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": [
+        "summary", "key_points", "key_numbers", "topics",
+        "countries", "dates", "impact_level", "confidence",
+    ],
+    "properties": {
+        "summary": _STR,
+        "key_points": {"type": "array", "items": _STR},
+        "key_numbers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["metric", "value", "unit", "context"],
+                "properties": {
+                    "metric": _STR,
+                    "value": {"type": ["string", "number"]},
+                    "unit": _STR_OR_NULL,
+                    "context": _STR,
+                },
+            },
+        },
+        "topics": {"type": "array", "items": _STR},
+        "countries": {"type": "array", "items": _STR},
+        "dates": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["published", "horizon"],
+            "properties": {"published": _STR_OR_NULL, "horizon": _STR_OR_NULL},
+        },
+        "impact_level": {"type": "string", "enum": ["low", "medium", "high"]},
+        "confidence": {"type": "number"},
+    },
+}
+
+# Por debajo de este tamaño (chars) el modelo pequeño basta
+SMALL_MODEL_MAX_CHARS = 40_000
+
+def _pick_model(text: str, source: str) -> str:
     """
-    Devuelve JSON estructurado para guardar en regulations.
-    Nota: endpoint/model puede variar; dejamos model configurable.
+    Informes cortos y los briefs de IEA van al modelo barato;
+    solo los informes largos (IMF REO) pagan el modelo grande.
     """
-    model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
-    base_url = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com").rstrip("/")
+    if len(text) < SMALL_MODEL_MAX_CHARS or source == "iea_gas_reports":
+        return os.environ.get("OPENAI_MODEL_SMALL", "gpt-4o-mini")
+    return os.environ.get("OPENAI_MODEL_LARGE") or os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+
+def _parse_completion(data: dict[str, Any], model: str) -> dict[str, Any]:
+    choice = data["choices"][0]
+    # strict mode: una negativa llega con content null; "length" = JSON truncado
+    if choice.get("finish_reason") == "length":
+        raise ValueError("completion truncated at max_tokens")
+    content = choice["message"].get("content")
+    if content is None:
+        raise ValueError(f"model refused: {choice['message'].get('refusal')}")
+    out = json_loads(content)
+    out["model"] = data.get("model") or model
+    return out
+
+def _build_payload(text: str, *, title: str, source: str) -> dict[str, Any]:
+    model = _pick_model(text, source)
 
-    system = (
-        "You are a senior economic and energy analyst. "
-        "Return STRICT JSON only, no markdown."
-    )
     user = {
-        "task": "Summarize and extract structured signals from the report text.",
         "source": source,
         "title": title,
-        "required_json_schema": {
-            "summary": "string (120-200 words, neutral, dense, no hype)",
-            "key_points": ["bullet strings (6-10)"],
-            "key_numbers": [{"metric":"string","value":"string/number","unit":"string|null","context":"string"}],
-            "topics": ["strings"],
-            "countries": ["strings"],
-            "dates": {"published":"string|null","horizon":"string|null","other":"object"},
-            "impact_level": "low|medium|high",
-            "confidence": "number 0-1"
-        },
-        "constraints": [
-            "If unsure, be explicit via lower confidence.",
-            "Prefer extracting numbers that are clearly stated.",
-            "Do not invent data."
-        ],
-        "text": text[:200_000],  # recorte defensivo
+        "text": text[:MAX_INPUT_CHARS],  # recorte defensivo
     }
 
     payload = {
         "model": model,
         "temperature": 0.2,
+        "max_tokens": MAX_OUTPUT_TOKENS,
         "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(user, ensure_ascii=False)},
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": json_dumps(user).decode("utf-8")},
         ],
-        "response_format": {"type": "json_object"},
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "report_summary", "strict": True, "schema": REPORT_SCHEMA},
+        },
     }
+    return payload
+
+def _backoff(attempt: int) -> float:
+    return min(2 ** attempt + random.random(), MAX_RETRY_DELAY_S)
 
-    with httpx.Client(timeout=90) as c:
-        r = c.post(f"{base_url}/v1/chat/completions", headers=_openai_headers(), json=payload)
-        r.raise_for_status()
-        data = r.json()
+def _request_with_retry(
+    method: str, url: str, *, idempotent: bool = True, max_attempts: int = 5, **kwargs: Any
+) -> httpx.Response:
+    """
+    Petición a OpenAI con backoff exponencial + jitter.
+    Reintenta 429/5xx (respetando Retry-After, con tope) y errores de red.
+    Con idempotent=False (subir el fichero, crear el batch) solo reintenta
+    los errores previos al envío: si el servidor creó el recurso y se perdió
+    la respuesta, otro intento lo duplicaría y se cobraría dos veces.
+    """
+    retry_errors = httpx.RequestError if idempotent else UNSENT_ERRORS
+    last_exc: Exception | None = None
+    for attempt in range(max_attempts):
+        try:
+            r = _get_client().request(method, url, **kwargs)
+        except retry_errors as e:
+            last_exc = e
+            delay = _backoff(attempt)
+        else:
+            if not idempotent or r.status_code not in RETRY_STATUSES or attempt == max_attempts - 1:
+                r.raise_for_status()
+                return r
+            try:
+                delay = min(max(float(r.headers["retry-after"]), 0), MAX_RETRY_DELAY_S)
+            except (KeyError, ValueError):
+                delay = _backoff(attempt)
+        if attempt < max_attempts - 1:
+            time.sleep(delay)
+
+    raise RuntimeError(f"OpenAI request failed after {max_attempts} attempts: {url}. Last error: {last_exc}")
+
+def summarize_report(text: str, *, title: str, source: str) -> dict[str, Any]:
+    """
+    Devuelve JSON estructurado para guardar en regulations.
+    Nota: endpoint/model puede variar; dejamos model configurable.
+    """
+    payload = _build_payload(text, title=title, source=source)
+
+    r = _request_with_retry(
+        "POST", f"{_base_url()}/v1/chat/completions", headers=_openai_headers(), json=payload, timeout=90
+    )
+    return _parse_completion(r.json(), payload["model"])
+
+def group_jobs_by_model(jobs: list[dict[str, Any]]) -> dict[str, list[dict[str, Any]]]:
+    """
+    El Batch API admite un solo modelo por fichero de entrada: agrupa los
+    jobs por el modelo que les toca, un submit_batch por grupo.
+    """
+    groups: dict[str, list[dict[str, Any]]] = {}
+    for job in jobs:
+        groups.setdefault(_pick_model(job["text"], job["source"]), []).append(job)
+    return groups
+
+def submit_batch(jobs: list[dict[str, Any]]) -> str:
+    """
+    Sube los jobs como un único batch (/v1/batches) y devuelve el batch_id.
+    Cada job: {"custom_id", "text", "title", "source"}; todos deben ir al
+    mismo modelo (ver group_jobs_by_model).
+    """
+    lines = []
+    models = set()
+    for job in jobs:
+        body = _build_payload(job["text"], title=job["title"], source=job["source"])
+        models.add(body["model"])
+        lines.append(json_dumps({
+            "custom_id": job["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }))
+    if len(models) > 1:
+        raise ValueError(f"one model per batch, got {sorted(models)}")
+    jsonl = b"\n".join(lines) + b"\n"
+
+    auth = {"Authorization": _openai_headers()["Authorization"]}
+    r = _request_with_retry(
+        "POST",
+        f"{_base_url()}/v1/files",
+        idempotent=False,
+        headers=auth,
+        data={"purpose": "batch"},
+        files={"file": ("batch.jsonl", jsonl, "application/jsonl")},
+        timeout=120,
+    )
+    file_id = r.json()["id"]
+
+    r = _request_with_retry(
+        "POST",
+        f"{_base_url()}/v1/batches",
+        idempotent=False,
+        headers=_openai_headers(),
+        json={
+            "input_file_id": file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        },
+        timeout=60,
+    )
+    return r.json()["id"]
+
+def poll_batch(batch_id: str, *, interval_s: float = 30.0, timeout_s: float = 4 * 3600) -> dict[str, dict[str, Any]]:
+    """
+    Espera a que el batch termine y devuelve {custom_id: json resumido}.
+    Las peticiones que fallan dentro del batch (error, negativa, salida
+    truncada) simplemente no aparecen en el dict; el resto se conserva.
+    Si vence timeout_s lanza BatchPendingError (timeout_s=0: una sola consulta);
+    BatchFailedError solo si el batch terminó sin resultados. Cualquier otro
+    error (red, HTTP) no dice nada del batch, que puede seguir en curso.
+    """
+    deadline = time.monotonic() + timeout_s
+    while True:
+        r = _request_with_retry("GET", f"{_base_url()}/v1/batches/{batch_id}", headers=_openai_headers(), timeout=60)
+        batch = r.json()
+        status = batch.get("status")
+        if status == "completed":
+            break
+        if status in ("failed", "expired", "cancelled"):
+            raise BatchFailedError(batch_id, status)
+        if time.monotonic() >= deadline:
+            raise BatchPendingError(batch_id, status)
+        time.sleep(interval_s)
+
+    output_file_id = batch.get("output_file_id")
+    if not output_file_id:
+        return {}
+    r = _request_with_retry(
+        "GET", f"{_base_url()}/v1/files/{output_file_id}/content", headers=_openai_headers(), timeout=120
+    )
 
-    content = data["choices"][0]["message"]["content"]
-    return json.loads(content)
+    out: dict[str, dict[str, Any]] = {}
+    for line in r.text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json_loads(line)
+            resp = row.get("response") or {}
+            if resp.get("status_code") != 200:
+                continue
+            out[row["custom_id"]] = _parse_completion(resp["body"], "")
+        except (KeyError, IndexError, TypeError, ValueError):
+            # una línea rota no invalida el resto del batch (ya pagado)
+            continue
+    return out
@@ -1,11 +1,79 @@
 ﻿from __future__ import annotations
 from pathlib import Path
+from typing import IO, Iterator
 import fitz  # PyMuPDF
 
-def extract_text_from_pdf(pdf_path: Path) -> str:
+from docdl.util import new_content_hasher
+
+try:
+    import lz4.frame
+except ImportError:  # optional: only needed for .txt.lz4 artifacts
+    lz4 = None
+
+def _open_extracted(path: Path, mode: str) -> IO:
+    # extracted text is plain .txt, or an LZ4 frame when the path ends in .lz4
+    if path.suffix != ".lz4":
+        return path.open(mode, encoding="utf-8" if "t" in mode else None)
+    if lz4 is None:
+        raise RuntimeError(f"{path.name}: .lz4 artifacts require the lz4 package")
+    if "t" in mode:
+        return lz4.frame.open(path, mode, encoding="utf-8")
+    return lz4.frame.open(path, mode, compression_level=0)
+
+def read_extracted_text(path: Path, max_chars: int | None = None) -> str:
+    """Read back an extracted text artifact (.txt or .txt.lz4)."""
+    with _open_extracted(path, "rt") as f:
+        return f.read(-1 if max_chars is None else max_chars)
+
+def iter_extract_text_from_pdf(pdf_path: Path, max_chars: int | None = None) -> Iterator[str]:
+    """
+    Yield page text in order, one chunk per page ("\n"-separated like
+    extract_text_from_pdf, but not stripped). With max_chars, stop loading
+    pages once that much text has been yielded.
+    """
     doc = fitz.open(pdf_path)
-    parts = []
-    for page in doc:
-        parts.append(page.get_text("text"))
-    doc.close()
-    return "\n".join(parts).strip()
+    try:
+        total = 0
+        for i in range(doc.page_count):
+            t = doc.load_page(i).get_text("text")
+            yield t if i == 0 else "\n" + t
+            total += len(t)
+            if max_chars is not None and total > max_chars:
+                break
+    finally:
+        doc.close()
+
+def extract_text_from_pdf(pdf_path: Path, max_chars: int | None = None) -> str:
+    return "".join(iter_extract_text_from_pdf(pdf_path, max_chars)).strip()
+
+def extract_text_to_file(pdf_path: Path, text_path: Path, max_chars: int | None = None) -> tuple[str, int]:
+    """
+    Stream the extracted text page by page into text_path (UTF-8, LZ4 framed
+    if it ends in .lz4) and the
+    content hasher, so the whole document is never held in memory. Output
+    and hash match extract_text_from_pdf + sha256_text. Returns
+    (content_hash, length in chars).
+    """
+    h = new_content_hasher()
+    length = 0
+    started = False
+    pending_ws = ""  # trailing whitespace, only written if more text follows
+
+    with _open_extracted(text_path, "wb") as f:
+        for chunk in iter_extract_text_from_pdf(pdf_path, max_chars):
+            if not started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+            body = chunk.rstrip()
+            if not body:
+                pending_ws += chunk
+                continue
+            b = (pending_ws + body).encode("utf-8")
+            f.write(b)
+            h.update(b)
+            length += len(pending_ws) + len(body)
+            pending_ws = chunk[len(body):]
+
+    return h.hexdigest(), length
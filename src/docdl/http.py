@@ -1,11 +1,13 @@
 ﻿from __future__ import annotations
-import time
+import asyncio
 import random
 from dataclasses import dataclass
 from urllib.parse import urlparse
 
 import httpx
 
+from .util import AsyncTokenBucket
+
 @dataclass
 class HttpConfig:
     user_agent: str
@@ -15,33 +17,36 @@ class HttpConfig:
     backoff_statuses: tuple[int, ...] = (429, 503)
 
 class RateLimiter:
+    """
+    Per-domain request rate shared by all coroutines of a run: a token
+    bucket per domain, so concurrent workers share one rate instead of each
+    being throttled separately. Different hosts never wait on each other.
+    """
     def __init__(self, rps_per_domain: float):
         self.rps = rps_per_domain
-        self._last_by_domain: dict[str, float] = {}
+        self._buckets: dict[str, AsyncTokenBucket] = {}
 
-    def wait(self, url: str):
+    async def wait_async(self, url: str):
         domain = urlparse(url).netloc
-        now = time.time()
-        last = self._last_by_domain.get(domain, 0.0)
-        min_interval = 1.0 / max(self.rps, 0.1)
-        sleep_s = (last + min_interval) - now
-        if sleep_s > 0:
-            time.sleep(sleep_s)
-        self._last_by_domain[domain] = time.time()
-
-def fetch(client: httpx.Client, rl: RateLimiter, url: str, *, cfg: HttpConfig) -> httpx.Response:
+        bucket = self._buckets.get(domain)
+        if bucket is None:
+            # burst of up to rps requests, then rps per second
+            bucket = self._buckets[domain] = AsyncTokenBucket(self.rps, capacity=max(1, int(self.rps)))
+        await bucket.acquire()
+
+async def fetch_async(client: httpx.AsyncClient, rl: RateLimiter, url: str, *, cfg: HttpConfig) -> httpx.Response:
     headers = {"User-Agent": cfg.user_agent}
     last_exc = None
 
     for attempt in range(cfg.max_retries + 1):
         try:
-            rl.wait(url)
-            resp = client.get(url, headers=headers, timeout=cfg.timeout_s, follow_redirects=True)
+            await rl.wait_async(url)
+            resp = await client.get(url, headers=headers, timeout=cfg.timeout_s, follow_redirects=True)
 
             if resp.status_code in cfg.backoff_statuses:
                 # exponential backoff with jitter
                 backoff = (2 ** attempt) + random.random()
-                time.sleep(backoff)
+                await asyncio.sleep(backoff)
                 continue
 
             return resp
@@ -49,7 +54,6 @@ def fetch(client: httpx.Client, rl: RateLimiter, url: str, *, cfg: HttpConfig) -
         except Exception as e:
             last_exc = e
             backoff = (2 ** attempt) + random.random()
-            time.sleep(backoff)
+            await asyncio.sleep(backoff)
 
     raise RuntimeError(f"Failed to fetch after retries: {url}. Last error: {last_exc}")
-
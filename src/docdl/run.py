@@ -1,37 +1,280 @@
 ﻿from __future__ import annotations
 
-import json
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 
-import yaml
+import httpx
 
-from docdl.http import HttpConfig
-from docdl.discover import discover_imf_reo_meca, discover_iea_natural_gas_reports
+from docdl.config import load_yaml_cached
+from docdl.http import HttpConfig, RateLimiter
+from docdl.discover import DiscoveredItem, discover_imf_reo_meca, discover_iea_natural_gas_reports
 from docdl.resolve import resolve_imf_issue_to_pdf, resolve_iea_report_to_pdf
 from docdl.download import download_pdf, PaywallOrHtmlError
-from docdl.extract import extract_text_from_pdf
-from docdl.enrich import summarize_report
-from docdl.util import sha256_text
+from docdl.extract import extract_text_to_file, read_extracted_text
+from docdl.enrich import (
+    MAX_INPUT_CHARS,
+    BatchFailedError,
+    BatchPendingError,
+    group_jobs_by_model,
+    summarize_report,
+    submit_batch,
+    poll_batch,
+)
+from docdl.util import CONTENT_HASH_ALGO, atomic_write_bytes, json_dumps, json_loads
 from docdl.store import SupabaseStore
 
 
+# Max number of items in flight (run.max_concurrency in sources.yaml overrides)
+DEFAULT_MAX_CONCURRENCY = 8
+
+# doc_urls stored in regulations within this window are not reprocessed
+KNOWN_DOC_WINDOW = timedelta(days=7)
+
+# Stop extracting pages past this many chars; enrich only sends a prefix anyway
+EXTRACT_MAX_CHARS = 200_000
+
+# PDF parsing is CPU-bound: extract in worker processes, one per core by
+# default (DOCDL_EXTRACT_WORKERS overrides)
+EXTRACT_WORKERS = int(os.environ.get("DOCDL_EXTRACT_WORKERS") or os.cpu_count() or 2)
+_pdf_pool: ProcessPoolExecutor | None = None
+
+# DOCDL_COMPRESS_EXTRACTED=1 writes data/extracted/*.txt.lz4 instead of plain .txt
+COMPRESS_EXTRACTED = os.environ.get("DOCDL_COMPRESS_EXTRACTED") == "1"
+
+# ingest_items statuses that end an item; only these are written to Supabase
+TERMINAL_STATUSES = frozenset({"stored", "failed", "skipped_paywall"})
+
+
 # -------------------------------------------------------------------
 # Helpers
 # -------------------------------------------------------------------
 
+def pdf_pool() -> ProcessPoolExecutor:
+    """
+    The extraction pool, created on first use so importing this module (as
+    worker processes do) starts nothing. Workers come from a forkserver where
+    the platform has one, not a fork of this process, which by then holds
+    live HTTP clients and the status updater thread.
+    """
+    global _pdf_pool
+    if _pdf_pool is None:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pdf_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _pdf_pool
+
+
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def series_name(source_id: str) -> str:
+    return (
+        "IMF Regional Economic Outlook – MECA"
+        if source_id == "imf_reo_meca"
+        else "IEA Natural Gas Reports"
+    )
+
+
+def enriched_from_regulation(row: dict) -> dict:
+    """Rebuild the summarize_report() dict from a stored regulations row."""
+    return {
+        "summary": row.get("summary"),
+        "key_points": row.get("key_points") or [],
+        "key_numbers": row.get("key_numbers") or [],
+        "topics": row.get("topics") or [],
+        "countries": row.get("countries") or [],
+        "dates": row.get("dates") or {},
+        "impact_level": row.get("impact_level"),
+        "confidence": row.get("confidence"),
+        "model": (row.get("meta") or {}).get("model"),
+    }
+
+
+def read_enrich_cache(path: str) -> dict | None:
+    """
+    Cached enrichment for a content_hash, or None on a miss. Unreadable or
+    corrupt entries (e.g. left by an older non-atomic write) count as a miss
+    and are removed so they get rewritten.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = json_loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return None
+    return data
+
+
+def load_pending_batches(path: Path) -> dict[str, dict[str, str]]:
+    # {batch_id: {custom_id: content_hash}} of batches a past run stopped waiting for
+    try:
+        return json_loads(path.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_pending_batch(path: Path, batch_id: str, hashes: dict[str, str]) -> None:
+    """Record a submitted batch ({custom_id: content_hash}) for a later run to collect."""
+    pending = load_pending_batches(path)
+    pending[batch_id] = hashes
+    atomic_write_bytes(path, json_dumps(pending))
+
+
+def resume_pending_batches(path: Path, cache_dir: str) -> tuple[set[str], list[dict]]:
+    """
+    Collect batches an earlier run timed out on: finished results go into the
+    enrich cache (so this run's lookups hit them), still-running batches stay
+    on file. Returns (content_hashes still pending, errors).
+    """
+    pending = load_pending_batches(path)
+    if not pending:
+        return set(), []
+
+    still: dict[str, dict[str, str]] = {}
+    errors: list[dict] = []
+    for batch_id, hashes in pending.items():
+        try:
+            results = poll_batch(batch_id, timeout_s=0)
+        except BatchFailedError as e:
+            # failed / expired / cancelled: nothing left to collect
+            errors.append({"stage": "enrich_resume", "batch_id": batch_id, "error": str(e)})
+            continue
+        except Exception as e:
+            still[batch_id] = hashes  # running, or just unreachable now
+            if not isinstance(e, BatchPendingError):
+                errors.append({"stage": "enrich_resume", "batch_id": batch_id, "error": str(e)})
+            continue
+        for custom_id, enriched in results.items():
+            if custom_id in hashes:
+                atomic_write_bytes(os.path.join(cache_dir, hashes[custom_id] + ".json"), json_dumps(enriched))
+
+    atomic_write_bytes(path, json_dumps(still))
+    return {h for hashes in still.values() for h in hashes.values()}, errors
+
+
+@dataclass
+class PreparedItem:
+    """An item that made it through resolve -> download -> extract."""
+    item: DiscoveredItem
+    ingest_row: dict
+    pdf_url: str
+    pdf_path: Path
+    pdf_hash: str
+    text_path: Path
+    text_length: int
+    content_hash: str
+
+    def read_text(self) -> str:
+        # enrich never sends more than MAX_INPUT_CHARS, so don't load the rest
+        return read_extracted_text(self.text_path, MAX_INPUT_CHARS)
+
+    @property
+    def custom_id(self) -> str:
+        # batch request id; identical texts from the same source share it
+        return f"{self.item.source_id}_{self.content_hash[:16]}"
+
+
+class StatusUpdater(threading.Thread):
+    """
+    Drains ingest_items status updates on a background thread so the
+    Supabase round-trips stay off the item pipeline. A single worker keeps
+    updates for the same doc_url in the order they were posted.
+
+    Intermediate statuses are only accumulated in memory and appended to a
+    local JSONL journal; Supabase gets a single PATCH per item once it
+    reaches a terminal status, carrying everything gathered on the way.
+    """
+
+    def __init__(self, store: SupabaseStore, journal_path: Path):
+        super().__init__(name="status-updater", daemon=True)
+        self._store = store
+        self._journal_path = journal_path
+        self._queue: queue.Queue[tuple | None] = queue.Queue()
+        self._lock = threading.Lock()
+        self._state: dict[str, dict] = {}
+        self.errors: list[dict] = []
+
+    def post(self, doc_url: str, status: str, *, extra: dict | None = None, error: str | None = None) -> None:
+        self._queue.put((doc_url, status, extra, error))
+
+    def run(self) -> None:
+        with self._journal_path.open("ab") as journal:
+            while (job := self._queue.get()) is not None:
+                doc_url, status, extra, error = job
+                state = self._state.setdefault(doc_url, {})
+                if extra:
+                    state.update(extra)
+
+                journal.write(
+                    json_dumps({"ts": utc_now_iso(), "doc_url": doc_url, "status": status, "error": error, **(extra or {})})
+                    + b"\n"
+                )
+                journal.flush()
+
+                if status not in TERMINAL_STATUSES:
+                    continue
+                try:
+                    self._store.set_ingest_item_status(doc_url, status, extra=self._state.pop(doc_url), error=error)
+                except Exception as e:
+                    with self._lock:
+                        self.errors.append(
+                            {"stage": "status", "doc_url": doc_url, "status": status, "error": str(e)}
+                        )
+
+    def close(self) -> None:
+        """Flush pending updates and stop the worker."""
+        self._queue.put(None)
+        self.join()
+
+
+class RunLog:
+    """
+    Append-only JSONL log of a run: one {"type": ..., ...} line per stored
+    item or error, flushed as it is written so a crash keeps what happened
+    up to that point.
+    """
+
+    def __init__(self, path: Path):
+        self._f = path.open("ab")
+        self.error_count = 0
+
+    def write(self, kind: str, record: dict) -> None:
+        self._f.write(json_dumps({"type": kind, **record}) + b"\n")
+        self._f.flush()
+
+    def error(self, record: dict) -> None:
+        self.error_count += 1
+        self.write("error", record)
+
+    def close(self) -> None:
+        self._f.close()
+
+
 # -------------------------------------------------------------------
 # Main
 # -------------------------------------------------------------------
 
-def main() -> None:
+async def _run(store: SupabaseStore, *, realtime: bool = False, force_enrich: bool = False) -> None:
     cfg_path = Path("config/sources.yaml")
-    conf = yaml.safe_load(cfg_path.read_text(encoding="utf-8"))
+    conf = load_yaml_cached(cfg_path)
 
     http_cfg = HttpConfig(
         user_agent=conf["run"]["user_agent"],
@@ -50,90 +293,153 @@ def main() -> None:
     out_extracted = Path("data/extracted")
     out_enriched = Path("data/enriched")
     out_logs = Path("data/logs")
+    out_enriched_cache = out_enriched / ".cache"
 
-    for p in [out_discovered, out_raw, out_extracted, out_enriched, out_logs]:
-        p.mkdir(parents=True, exist_ok=True)
+    for d in (out_discovered, out_raw, out_extracted, out_enriched, out_logs, out_enriched_cache):
+        os.makedirs(d, exist_ok=True)
+    # hit once or twice per item: join plain strings instead of Path objects
+    enrich_cache_dir = os.fspath(out_enriched_cache)
+    pending_batches_path = out_enriched_cache / "pending_batches.json"
 
-    store = SupabaseStore()
+    updater = StatusUpdater(store, out_logs / f"{run_id}.items.jsonl")
+    updater.start()
 
+    # per-item records and errors go to the JSONL as they happen; `log` only
+    # keeps the small run summary written at the end
+    run_log = RunLog(out_logs / f"{run_id}.jsonl")
     log = {
         "run_id": run_id,
         "started_at": utc_now_iso(),
-        "sources": [],
-        "errors": [],
         "counts": {
             "discovered": 0,
             "processed": 0,
             "failed": 0,
             "skipped_paywall": 0,
+            "skipped_known": 0,
+            "skipped_unchanged": 0,
+            "enrich_cached": 0,
         },
     }
 
-    # ---------------------------------------------------------------
-    # Register run start
-    # ---------------------------------------------------------------
-    store.upsert_ingest_run(
-        {
-            "run_id": run_id,
-            "started_at": utc_now_iso(),
-            "sources_count": 2,
-            "success_count": 0,
-            "fail_count": 0,
-            "meta": {"mode": "force_enrich_debug"},
-        }
-    )
-
-    # ---------------------------------------------------------------
-    # DISCOVER
-    # ---------------------------------------------------------------
-    discovered_items = []
-
     try:
-        discovered_items.extend(
-            discover_imf_reo_meca(
-                "https://www.imf.org/en/publications/reo/meca",
-                cfg=http_cfg,
-            )
-        )
-        discovered_items.extend(
-            discover_iea_natural_gas_reports(
-                "https://www.iea.org/analysis?type=report&energySystem%5B0%5D=natural-gas",
-                cfg=http_cfg,
-                limit=5,
-            )
-        )
-    except Exception as e:
-        log["errors"].append(
-            {"stage": "discover", "error": str(e)}
+        # ---------------------------------------------------------------
+        # Register run start
+        # ---------------------------------------------------------------
+        store.upsert_ingest_run(
+            {
+                "run_id": run_id,
+                "started_at": utc_now_iso(),
+                "sources_count": 2,
+                "success_count": 0,
+                "fail_count": 0,
+                "meta": {"mode": "force_enrich" if force_enrich else "cached", "enrich": "realtime" if realtime else "batch"},
+            }
         )
 
-    log["counts"]["discovered"] = len(discovered_items)
-
-    (out_discovered / f"{run_id}.jsonl").write_text(
-        "\n".join(json.dumps(x.__dict__, ensure_ascii=False) for x in discovered_items),
-        encoding="utf-8",
-    )
-
-    # ---------------------------------------------------------------
-    # PROCESS EACH ITEM
-    # ---------------------------------------------------------------
-    success = 0
-    failed = 0
-
-    for item in discovered_items:
-        try:
-            # -------------------------------------------------------
-            # Upsert ingest item (early)
-            # -------------------------------------------------------
-            ingest_row = store.upsert_ingest_item(
+        # One rate limiter for every stage, so resolve -> download bursts against
+        # the same host still respect rps_per_domain.
+        rl = RateLimiter(http_cfg.rps_per_domain)
+
+        # One pooled client for every stage so keep-alive / HTTP/2 connections
+        # are reused across discover, resolve and download.
+        async with httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            headers={"User-Agent": http_cfg.user_agent},
+            timeout=http_cfg.timeout_s,
+        ) as client:
+            # ---------------------------------------------------------------
+            # DISCOVER
+            # ---------------------------------------------------------------
+            # Both sources live on independent domains: discover them concurrently
+            # and keep whatever succeeds (one failing source doesn't drop the other).
+            discovered_items = []
+
+            results = await asyncio.gather(
+                discover_imf_reo_meca(
+                    client,
+                    rl,
+                    "https://www.imf.org/en/publications/reo/meca",
+                    cfg=http_cfg,
+                ),
+                discover_iea_natural_gas_reports(
+                    client,
+                    rl,
+                    "https://www.iea.org/analysis?type=report&energySystem%5B0%5D=natural-gas",
+                    cfg=http_cfg,
+                    limit=5,
+                ),
+                return_exceptions=True,
+            )
+            for source_id, result in zip(("imf_reo_meca", "iea_gas_reports"), results):
+                if isinstance(result, BaseException):
+                    run_log.error(
+                        {"stage": "discover", "source_id": source_id, "error": str(result)}
+                    )
+                else:
+                    discovered_items.extend(result)
+
+            log["counts"]["discovered"] = len(discovered_items)
+
+            with (out_discovered / f"{run_id}.jsonl").open("wb", buffering=1 << 20) as f:
+                for x in discovered_items:
+                    f.write(json_dumps(x.__dict__))
+                    f.write(b"\n")
+
+            # ---------------------------------------------------------------
+            # DEDUPE: each (source_id, doc_url) once per run, and skip doc_urls
+            # stored recently unless --force-enrich
+            # ---------------------------------------------------------------
+            seen: set[tuple[str, str]] = set()
+            unique_items = []
+            for x in discovered_items:
+                key = (x.source_id, x.doc_url)
+                if key not in seen:
+                    seen.add(key)
+                    unique_items.append(x)
+            discovered_items = unique_items
+
+            if not force_enrich and discovered_items:
+                try:
+                    known = await asyncio.to_thread(store.get_known_doc_urls, since=KNOWN_DOC_WINDOW)
+                except Exception as e:
+                    known = set()
+                    run_log.error({"stage": "dedupe", "error": str(e)})
+                fresh = [x for x in discovered_items if x.doc_url not in known]
+                log["counts"]["skipped_known"] = len(discovered_items) - len(fresh)
+                discovered_items = fresh
+
+            # ---------------------------------------------------------------
+            # Collect OpenAI batches an earlier run stopped waiting for, so
+            # their (already billed) results land in the enrich cache
+            # ---------------------------------------------------------------
+            pending_hashes, resume_errors = await asyncio.to_thread(
+                resume_pending_batches, pending_batches_path, enrich_cache_dir
+            )
+            for e in resume_errors:
+                run_log.error(e)
+
+            def fail(item, e: Exception) -> None:
+                run_log.error(
+                    {
+                        "stage": "process",
+                        "source_id": item.source_id,
+                        "doc_url": item.doc_url,
+                        "error": str(e),
+                    }
+                )
+                updater.post(item.doc_url, "failed", error=str(e))
+
+            # ---------------------------------------------------------------
+            # Upsert ingest items: one bulk request for the whole run, ids are
+            # matched back by doc_url. Supabase calls are blocking, so they go
+            # through to_thread (or the status updater) off the event loop.
+            # ---------------------------------------------------------------
+            ingest_payloads = [
                 {
                     "run_id": run_id,
                     "source_id": item.source_id,
-                    "series": (
-                        "IMF Regional Economic Outlook – MECA"
-                        if item.source_id == "imf_reo_meca"
-                        else "IEA Natural Gas Reports"
-                    ),
+                    "series": series_name(item.source_id),
                     "title": item.title,
                     "doc_url": item.doc_url,
                     "language": "en",
@@ -141,157 +447,382 @@ def main() -> None:
                     "status": "discovered",
                     "meta": {},
                 }
-            )
-
-            # -------------------------------------------------------
-            # Resolve PDF
-            # -------------------------------------------------------
-            if item.source_id == "imf_reo_meca":
-                resolved = resolve_imf_issue_to_pdf(
-                    item.doc_url,
-                    item.title,
-                    cfg=http_cfg,
-                )
-            else:
-                resolved = resolve_iea_report_to_pdf(
-                    item.doc_url,
-                    item.title,
-                    cfg=http_cfg,
-                )
-
-            store.set_ingest_item_status(
-                item.doc_url,
-                "discovered",
-                extra={"pdf_url": resolved.pdf_url},
-            )
-
-            # -------------------------------------------------------
-            # Download
-            # -------------------------------------------------------
+                for item in discovered_items
+            ]
+            ingest_jobs: list[tuple[DiscoveredItem, dict]] = []
             try:
-                pdf_path = download_pdf(
-                    item.source_id,
-                    resolved.pdf_url,
-                    out_raw,
-                    cfg=http_cfg,
-                )
-            except PaywallOrHtmlError as e:
-                store.set_ingest_item_status(
-                    item.doc_url,
-                    "skipped_paywall",
-                    error=str(e),
-                )
-                log["counts"]["skipped_paywall"] += 1
-                continue
-
-            store.set_ingest_item_status(item.doc_url, "downloaded")
-
-            # -------------------------------------------------------
-            # Extract
-            # -------------------------------------------------------
-            text = extract_text_from_pdf(pdf_path)
-            text_path = out_extracted / f"{pdf_path.stem}.txt"
-            text_path.write_text(text, encoding="utf-8")
-
-            content_hash = sha256_text(text)
-
-            store.set_ingest_item_status(
-                item.doc_url,
-                "extracted",
-                extra={
-                    "content_hash": content_hash,
-                    "raw_text_length": len(text),
-                },
-            )
-
-            # -------------------------------------------------------
-            # ENRICH (FORCED – NO DEDUPE)
-            # -------------------------------------------------------
-            print(">>> ENRICH START:", item.title)
-
-            enriched = summarize_report(
-                text,
-                title=item.title,
-                source=item.source_id,
-            )
-
-            enriched_path = out_enriched / f"{pdf_path.stem}.json"
-            enriched_path.write_text(
-                json.dumps(enriched, ensure_ascii=False, indent=2),
-                encoding="utf-8",
-            )
-
-            store.set_ingest_item_status(item.doc_url, "enriched")
-
-            # -------------------------------------------------------
-            # Upsert regulation (1:1)
-            # -------------------------------------------------------
-            ingest_item_id = ingest_row.get("id")
-            if not ingest_item_id:
-                raise RuntimeError("Missing ingest_item_id after upsert")
-
-            store.upsert_regulation(
-                {
-                    "ingest_item_id": ingest_item_id,
-                    "doc_url": item.doc_url,
-                    "source_id": item.source_id,
-                    "series": (
-                        "IMF Regional Economic Outlook – MECA"
+                ingest_rows = await asyncio.to_thread(store.bulk_upsert_ingest_items, ingest_payloads)
+                by_url = {row["doc_url"]: row for row in ingest_rows}
+            except Exception as e:
+                run_log.error({"stage": "ingest_items", "error": str(e)})
+                for item in discovered_items:
+                    updater.post(item.doc_url, "failed", error=str(e))
+                log["counts"]["failed"] += len(discovered_items)
+            else:
+                # an item without an ingest_items id could never be stored:
+                # fail it now, before paying for download/extract/enrich
+                for item in discovered_items:
+                    row = by_url.get(item.doc_url)
+                    if row and row.get("id"):
+                        ingest_jobs.append((item, row))
+                    else:
+                        fail(item, RuntimeError("Missing ingest_item_id after upsert"))
+                        log["counts"]["failed"] += 1
+
+            # ---------------------------------------------------------------
+            # PHASE 1: pipeline  download -> extract -> enrich
+            #   Each stage has its own workers fed by an asyncio.Queue, so the
+            #   extraction of item K overlaps the download of item K+1 and the
+            #   (realtime or cached) enrichment of item K-1.
+            # ---------------------------------------------------------------
+            max_concurrency = int(conf["run"].get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+            loop = asyncio.get_running_loop()
+
+            # On top of the worker count, cap in-flight requests per host so a
+            # burst of items on one site doesn't pile up behind its rate limit.
+            per_host = max(1, int(http_cfg.rps_per_domain))
+            host_sems: dict[str, asyncio.Semaphore] = {}
+
+            def host_sem(url: str) -> asyncio.Semaphore:
+                return host_sems.setdefault(urlparse(url).netloc, asyncio.Semaphore(per_host))
+
+            outcomes: list[str] = []
+            prepared: list[PreparedItem] = []
+            enriched_by_id: dict[str, dict] = {}
+
+            async def download_stage(job: tuple) -> tuple | None:
+                item, ingest_row = job
+                try:
+                    # -------------------------------------------------------
+                    # Resolve PDF
+                    # -------------------------------------------------------
+                    resolve = (
+                        resolve_imf_issue_to_pdf
                         if item.source_id == "imf_reo_meca"
-                        else "IEA Natural Gas Reports"
-                    ),
-                    "title": item.title,
-                    "pdf_url": resolved.pdf_url,
-                    "language": "en",
-                    "summary": enriched.get("summary"),
-                    "key_points": enriched.get("key_points", []),
-                    "key_numbers": enriched.get("key_numbers", []),
-                    "topics": enriched.get("topics", []),
-                    "countries": enriched.get("countries", []),
-                    "dates": enriched.get("dates", {}),
-                    "impact_level": enriched.get("impact_level"),
-                    "confidence": enriched.get("confidence"),
-                    "raw_text_length": len(text),
-                    "content_hash": content_hash,
-                }
-            )
-
-            store.set_ingest_item_status(item.doc_url, "stored")
-
-            log["sources"].append(
-                {
-                    "source_id": item.source_id,
-                    "title": item.title,
-                    "doc_url": item.doc_url,
-                    "pdf_url": resolved.pdf_url,
-                    "pdf_path": str(pdf_path),
-                    "text_path": str(text_path),
-                    "enriched_path": str(enriched_path),
-                }
+                        else resolve_iea_report_to_pdf
+                    )
+                    async with host_sem(item.doc_url):
+                        resolved = await resolve(
+                            client,
+                            rl,
+                            item.doc_url,
+                            item.title,
+                            cfg=http_cfg,
+                        )
+
+                    updater.post(
+                        item.doc_url,
+                        "discovered",
+                        extra={"pdf_url": resolved.pdf_url},
+                    )
+
+                    # -------------------------------------------------------
+                    # Download
+                    # -------------------------------------------------------
+                    try:
+                        async with host_sem(resolved.pdf_url):
+                            result = await download_pdf(
+                                client,
+                                rl,
+                                item.source_id,
+                                resolved.pdf_url,
+                                out_raw,
+                                cfg=http_cfg,
+                            )
+                    except PaywallOrHtmlError as e:
+                        updater.post(
+                            item.doc_url,
+                            "skipped_paywall",
+                            error=str(e),
+                        )
+                        outcomes.append("skipped_paywall")
+                        return None
+
+                    updater.post(item.doc_url, "downloaded")
+
+                    # -------------------------------------------------------
+                    # Unchanged PDF: this doc_url's regulation already has the
+                    # same bytes, so skip extract + enrich entirely (unless
+                    # --force-enrich). The same PDF under another doc_url
+                    # still goes through, so that doc_url gets its own row.
+                    # -------------------------------------------------------
+                    pdf_path, pdf_hash = result.path, result.pdf_hash
+                    if not force_enrich:
+                        try:
+                            row = await asyncio.to_thread(
+                                store.get_regulation_by_pdf_hash, pdf_hash, doc_url=item.doc_url
+                            )
+                        except Exception:
+                            row = None
+                        if row and row.get("doc_url") == item.doc_url:
+                            updater.post(
+                                item.doc_url,
+                                "stored",
+                                extra={
+                                    "content_hash": row.get("content_hash"),
+                                    "raw_text_length": row.get("raw_text_length"),
+                                    "meta": {"pdf_hash": pdf_hash, "unchanged": True},
+                                },
+                            )
+                            outcomes.append("skipped_unchanged")
+                            return None
+
+                    return item, ingest_row, resolved.pdf_url, pdf_path, pdf_hash
+
+                except Exception as e:
+                    fail(item, e)
+                    outcomes.append("failed")
+                    return None
+
+            async def extract_stage(downloaded: tuple) -> PreparedItem | None:
+                item, ingest_row, pdf_url, pdf_path, pdf_hash = downloaded
+                try:
+                    # -------------------------------------------------------
+                    # Extract (in the process pool, off the GIL)
+                    # -------------------------------------------------------
+                    # Pages are streamed into the .txt file and the hasher inside
+                    # the worker; only the hash and length come back.
+                    text_path = out_extracted / (f"{pdf_path.stem}.txt.lz4" if COMPRESS_EXTRACTED else f"{pdf_path.stem}.txt")
+                    content_hash, text_length = await loop.run_in_executor(
+                        pdf_pool(), extract_text_to_file, pdf_path, text_path, EXTRACT_MAX_CHARS
+                    )
+
+                    updater.post(
+                        item.doc_url,
+                        "extracted",
+                        extra={
+                            "content_hash": content_hash,
+                            "raw_text_length": text_length,
+                        },
+                    )
+
+                    return PreparedItem(
+                        item=item,
+                        ingest_row=ingest_row,
+                        pdf_url=pdf_url,
+                        pdf_path=pdf_path,
+                        pdf_hash=pdf_hash,
+                        text_path=text_path,
+                        text_length=text_length,
+                        content_hash=content_hash,
+                    )
+
+                except Exception as e:
+                    fail(item, e)
+                    outcomes.append("failed")
+                    return None
+
+            async def enrich_stage(p: PreparedItem) -> None:
+                # -------------------------------------------------------
+                # Enrich: cached by content_hash unless --force-enrich;
+                # in batch mode misses are collected for one batch below
+                # -------------------------------------------------------
+                prepared.append(p)
+
+                if not force_enrich:
+                    cached = read_enrich_cache(os.path.join(enrich_cache_dir, p.content_hash + ".json"))
+                    if cached is not None:
+                        enriched_by_id[p.custom_id] = cached
+                        outcomes.append("enrich_cached")
+                        return
+                    try:
+                        row = await asyncio.to_thread(store.get_regulation_by_content_hash, p.content_hash)
+                    except Exception:
+                        row = None
+                    if row:
+                        enriched_by_id[p.custom_id] = enriched_from_regulation(row)
+                        outcomes.append("enrich_cached")
+                        return
+
+                if realtime:
+                    print(">>> ENRICH START:", p.item.title)
+                    try:
+                        enriched = await asyncio.to_thread(
+                            summarize_report,
+                            p.read_text(),
+                            title=p.item.title,
+                            source=p.item.source_id,
+                        )
+                    except Exception as e:
+                        run_log.error(
+                            {"stage": "enrich", "doc_url": p.item.doc_url, "error": str(e)}
+                        )
+                        return
+                    enriched_by_id[p.custom_id] = enriched
+                    atomic_write_bytes(os.path.join(enrich_cache_dir, p.content_hash + ".json"), json_dumps(enriched))
+
+            async def run_stage(work, inbox: asyncio.Queue, outbox: asyncio.Queue | None, n_workers: int, n_downstream: int) -> None:
+                async def worker() -> None:
+                    while (x := await inbox.get()) is not None:
+                        y = await work(x)
+                        if y is not None and outbox is not None:
+                            await outbox.put(y)
+
+                await asyncio.gather(*(worker() for _ in range(n_workers)))
+                # this stage is drained: one sentinel per downstream worker
+                if outbox is not None:
+                    for _ in range(n_downstream):
+                        outbox.put_nowait(None)
+
+            # one extract worker per pool process (no point in more than items)
+            n_extract = max(1, min(len(ingest_jobs), EXTRACT_WORKERS))
+
+            download_q: asyncio.Queue = asyncio.Queue()
+            extract_q: asyncio.Queue = asyncio.Queue()
+            enrich_q: asyncio.Queue = asyncio.Queue()
+            for job in ingest_jobs:
+                download_q.put_nowait(job)
+            for _ in range(max_concurrency):
+                download_q.put_nowait(None)
+
+            await asyncio.gather(
+                run_stage(download_stage, download_q, extract_q, max_concurrency, n_extract),
+                run_stage(extract_stage, extract_q, enrich_q, n_extract, max_concurrency),
+                run_stage(enrich_stage, enrich_q, None, max_concurrency, 0),
             )
 
-            success += 1
-            log["counts"]["processed"] += 1
-
-        except Exception as e:
-            failed += 1
-            log["counts"]["failed"] += 1
-            log["errors"].append(
-                {
-                    "stage": "process",
-                    "source_id": item.source_id,
-                    "doc_url": item.doc_url,
-                    "error": str(e),
+            # tally per-stage outcomes after the fact instead of sharing counters
+            for outcome in outcomes:
+                log["counts"][outcome] += 1
+
+            # ---------------------------------------------------------------
+            # ENRICH (batch): everything not cached, one OpenAI batch per
+            # model (the Batch API takes a single model per input file)
+            # ---------------------------------------------------------------
+            # content still in flight in an earlier batch isn't paid for twice
+            to_enrich = [
+                p for p in prepared
+                if p.custom_id not in enriched_by_id and p.content_hash not in pending_hashes
+            ]
+
+            if not realtime and to_enrich:
+                # one job per distinct custom_id; identical texts share a summary
+                jobs = {
+                    p.custom_id: {
+                        "custom_id": p.custom_id,
+                        "text": p.read_text(),
+                        "title": p.item.title,
+                        "source": p.item.source_id,
+                    }
+                    for p in to_enrich
                 }
-            )
-            try:
-                store.set_ingest_item_status(
-                    item.doc_url,
-                    "failed",
-                    error=str(e),
+                hash_by_id = {p.custom_id: p.content_hash for p in to_enrich}
+
+                # submit every batch before polling, so they run side by side
+                batches: dict[str, dict[str, str]] = {}  # batch_id -> {custom_id: content_hash}
+                for model, group in group_jobs_by_model(list(jobs.values())).items():
+                    try:
+                        batch_id = await asyncio.to_thread(submit_batch, group)
+                    except Exception as e:
+                        run_log.error({"stage": "enrich", "model": model, "error": str(e)})
+                        continue
+                    print(">>> ENRICH BATCH:", batch_id, model, f"({len(group)} jobs)")
+                    batches[batch_id] = {job["custom_id"]: hash_by_id[job["custom_id"]] for job in group}
+                log["batch_ids"] = list(batches)
+
+                for batch_id, hashes in batches.items():
+                    try:
+                        enriched_by_id.update(await asyncio.to_thread(poll_batch, batch_id))
+                    except BatchFailedError as e:
+                        run_log.error({"stage": "enrich", "batch_id": batch_id, "error": str(e)})
+                    except Exception as e:
+                        # still running or unreachable: keep it for the next run
+                        # instead of abandoning a billed batch
+                        save_pending_batch(pending_batches_path, batch_id, hashes)
+                        pending_hashes.update(hashes.values())
+                        run_log.error({"stage": "enrich", "batch_id": batch_id, "error": f"{e}; resumed on next run"})
+
+            # batch results (realtime ones were cached as they came in)
+            for p in to_enrich:
+                enriched = enriched_by_id.get(p.custom_id)
+                if enriched is not None:
+                    atomic_write_bytes(os.path.join(enrich_cache_dir, p.content_hash + ".json"), json_dumps(enriched))
+
+            # ---------------------------------------------------------------
+            # PHASE 2: write enriched JSON, then upsert all regulations (1:1)
+            #          in a single bulk request
+            # ---------------------------------------------------------------
+            pending: list[tuple[PreparedItem, Path]] = []
+            pending_regs: dict[str, dict] = {}  # by doc_url: one row per conflict key
+
+            for p in prepared:
+                item = p.item
+                try:
+                    enriched = enriched_by_id.get(p.custom_id)
+                    if enriched is None:
+                        if p.content_hash in pending_hashes:
+                            raise RuntimeError("Enrichment pending in an OpenAI batch; collected on a later run")
+                        raise RuntimeError("No enrichment result for item")
+
+                    enriched_path = out_enriched / f"{p.pdf_path.stem}.json"
+                    enriched_path.write_bytes(json_dumps(enriched, indent=True))
+
+                    updater.post(item.doc_url, "enriched")
+
+                    ingest_item_id = p.ingest_row.get("id")
+                    if not ingest_item_id:
+                        raise RuntimeError("Missing ingest_item_id after upsert")
+
+                    pending_regs[item.doc_url] = {
+                        "ingest_item_id": ingest_item_id,
+                        "doc_url": item.doc_url,
+                        "source_id": item.source_id,
+                        "series": series_name(item.source_id),
+                        "title": item.title,
+                        "pdf_url": p.pdf_url,
+                        "language": "en",
+                        "summary": enriched.get("summary"),
+                        "key_points": enriched.get("key_points", []),
+                        "key_numbers": enriched.get("key_numbers", []),
+                        "topics": enriched.get("topics", []),
+                        "countries": enriched.get("countries", []),
+                        "dates": enriched.get("dates", {}),
+                        "impact_level": enriched.get("impact_level"),
+                        "confidence": enriched.get("confidence"),
+                        "raw_text_length": p.text_length,
+                        "content_hash": p.content_hash,
+                        "pdf_hash": p.pdf_hash,
+                        "meta": {"model": enriched.get("model"), "content_hash_algo": CONTENT_HASH_ALGO},
+                    }
+                    pending.append((p, enriched_path))
+
+                except Exception as e:
+                    fail(item, e)
+                    log["counts"]["failed"] += 1
+
+            if pending_regs:
+                try:
+                    await asyncio.to_thread(store.upsert_regulations, list(pending_regs.values()))
+                except Exception as e:
+                    for p, _ in pending:
+                        fail(p.item, e)
+                        log["counts"]["failed"] += 1
+                    pending = []
+
+            for p, enriched_path in pending:
+                updater.post(p.item.doc_url, "stored")
+
+                run_log.write(
+                    "source",
+                    {
+                        "source_id": p.item.source_id,
+                        "title": p.item.title,
+                        "doc_url": p.item.doc_url,
+                        "pdf_url": p.pdf_url,
+                        "pdf_path": str(p.pdf_path),
+                        "text_path": str(p.text_path),
+                        "enriched_path": str(enriched_path),
+                    }
                 )
-            except Exception:
-                pass
+
+                log["counts"]["processed"] += 1
+    finally:
+        # flush queued statuses and the run log on every exit path, so an
+        # exception mid-run doesn't silently drop them with the daemon thread
+        updater.close()
+        for e in updater.errors:
+            run_log.error(e)
+        run_log.close()
 
     # ---------------------------------------------------------------
     # Finalize run
@@ -299,27 +830,55 @@ def main() -> None:
     duration_s = round(time.time() - started_ts, 2)
     log["finished_at"] = utc_now_iso()
     log["duration_s"] = duration_s
+    log["errors"] = run_log.error_count
 
-    (out_logs / f"{run_id}.json").write_text(
-        json.dumps(log, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    log_bytes = json_dumps(log, indent=True)
+    (out_logs / f"{run_id}.summary.json").write_bytes(log_bytes)
 
     store.update_ingest_run(
         run_id,
         {
             "finished_at": utc_now_iso(),
-            "success_count": success,
-            "fail_count": failed,
+            "success_count": log["counts"]["processed"],
+            "fail_count": log["counts"]["failed"],
             "duration_s": duration_s,
             "meta": log["counts"],
         },
     )
 
-    print(json.dumps(log, ensure_ascii=False, indent=2))
+    # One line by default; DOCDL_VERBOSE=1 dumps the summary and the per-item
+    # JSONL as raw bytes (no decode / re-encode round-trip).
+    if os.environ.get("DOCDL_VERBOSE") == "1":
+        sys.stdout.flush()
+        sys.stdout.buffer.write(log_bytes + b"\n")
+        sys.stdout.buffer.write((out_logs / f"{run_id}.jsonl").read_bytes())
+        sys.stdout.buffer.flush()
+    else:
+        print(json_dumps({"run_id": run_id, "counts": log["counts"], "duration_s": duration_s}).decode("utf-8"))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="docdl")
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="summarize each document with a synchronous chat completion instead of one OpenAI batch",
+    )
+    parser.add_argument(
+        "--force-enrich",
+        action="store_true",
+        help="re-summarize every document even if its content_hash was enriched before",
+    )
+    args = parser.parse_args(argv)
+
+    store = SupabaseStore()
+    try:
+        asyncio.run(_run(store, realtime=args.realtime, force_enrich=args.force_enrich))
+    finally:
+        store.close()
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown()
 
 
 if __name__ == "__main__":
     main()
-
-
@@ -1,51 +1,138 @@
 ﻿from __future__ import annotations
 import os
+import threading
 import httpx
+from datetime import datetime, timedelta, timezone
 from typing import Any
+from urllib.parse import quote
+
+from docdl.util import BloomFilter, json_dumps, json_loads
+
+# per-request Prefer headers (auth and Content-Type live on the client);
+# built once instead of a fresh dict per call
+PREFER_MINIMAL = {"Prefer": "return=minimal"}
+PREFER_MERGE_MINIMAL = {"Prefer": "resolution=merge-duplicates,return=minimal"}
+PREFER_MERGE_REPRESENTATION = {"Prefer": "resolution=merge-duplicates,return=representation"}
+
+# in-memory filter of doc_urls / content_hashes / pdf_hashes present in
+# regulations, seeded once per run; lookups it rules out never reach Supabase.
+# Not persisted: rows written elsewhere (e.g. the weekly CI job) would be
+# false negatives in a filter carried over between runs.
+SEEN_BLOOM_CAPACITY = 300_000  # minimum; grows with the table
+SEEN_SEED_PAGE = 1000  # PostgREST's default max-rows
+
+def _seen_keys(row: dict[str, Any]):
+    yield f"url:{row['doc_url']}"
+    if row.get("content_hash"):
+        yield f"hash:{row['content_hash']}"
+    if row.get("pdf_hash"):
+        yield f"pdf:{row['pdf_hash']}"
 
 class SupabaseStore:
     def __init__(self):
         self.url = os.environ["SUPABASE_URL"].rstrip("/")
         self.key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
         self.rest = f"{self.url}/rest/v1"
-
-    def _headers(self) -> dict[str, str]:
-        return {
+        self._base_headers = {
             "apikey": self.key,
             "Authorization": f"Bearer {self.key}",
             "Content-Type": "application/json",
         }
+        # one long-lived client: keep-alive + HTTP/2 instead of a fresh
+        # TCP/TLS handshake per REST call
+        self._client = httpx.Client(
+            base_url=self.rest,
+            headers=self._base_headers,
+            timeout=30,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+        self._bloom: BloomFilter | None = None  # seeded on first lookup
+        self._bloom_lock = threading.Lock()
+
+    def close(self) -> None:
+        self._client.close()
+
+    def _seen(self) -> BloomFilter:
+        # Build the filter from every regulation row. Pages until an empty
+        # one: the server may cap a response below SEEN_SEED_PAGE, and a
+        # missed row would be a false negative.
+        with self._bloom_lock:
+            if self._bloom is None:
+                keys: list[str] = []
+                offset = 0
+                while True:
+                    r = self._client.get(
+                        "/regulations",
+                        params={
+                            "select": "doc_url,content_hash,pdf_hash",
+                            "order": "doc_url",
+                            "limit": str(SEEN_SEED_PAGE),
+                            "offset": str(offset),
+                        },
+                    )
+                    r.raise_for_status()
+                    rows = json_loads(r.content)
+                    if not rows:
+                        break
+                    for row in rows:
+                        keys.extend(_seen_keys(row))
+                    offset += len(rows)
+                bloom = BloomFilter(max(SEEN_BLOOM_CAPACITY, 2 * len(keys)))
+                for key in keys:
+                    bloom.add(key)
+                self._bloom = bloom
+            return self._bloom
+
+    def _mark_seen(self, rows: list[dict[str, Any]]) -> None:
+        # Called after a successful write, so it must not raise: an unseeded
+        # filter is left alone (the seed will read these rows back anyway).
+        with self._bloom_lock:
+            if self._bloom is None:
+                return
+            for row in rows:
+                for key in _seen_keys(row):
+                    self._bloom.add(key)
 
     def upsert_ingest_run(self, payload: dict[str, Any]) -> None:
         # upsert by run_id (unique)
-        with httpx.Client(timeout=30) as c:
-            r = c.post(
-                f"{self.rest}/ingest_runs?on_conflict=run_id",
-                headers={**self._headers(), "Prefer": "resolution=merge-duplicates,return=minimal"},
-                json=payload,
-            )
-            r.raise_for_status()
+        r = self._client.post(
+            "/ingest_runs?on_conflict=run_id",
+            headers=PREFER_MERGE_MINIMAL,
+            content=json_dumps(payload),
+        )
+        r.raise_for_status()
 
     def update_ingest_run(self, run_id: str, patch: dict[str, Any]) -> None:
-        with httpx.Client(timeout=30) as c:
-            r = c.patch(
-                f"{self.rest}/ingest_runs?run_id=eq.{httpx.QueryParams({'x':run_id})['x']}",
-                headers={**self._headers(), "Prefer": "return=minimal"},
-                json=patch,
-            )
-            r.raise_for_status()
+        r = self._client.patch(
+            f"/ingest_runs?run_id=eq.{quote(run_id, safe='')}",
+            headers=PREFER_MINIMAL,
+            content=json_dumps(patch),
+        )
+        r.raise_for_status()
 
     def upsert_ingest_item(self, payload: dict[str, Any]) -> dict[str, Any]:
         # upsert by doc_url (unique). Return representation to get id.
-        with httpx.Client(timeout=30) as c:
-            r = c.post(
-                f"{self.rest}/ingest_items?on_conflict=doc_url",
-                headers={**self._headers(), "Prefer": "resolution=merge-duplicates,return=representation"},
-                json=payload,
-            )
-            r.raise_for_status()
-            data = r.json()
-            return data[0] if data else {}
+        r = self._client.post(
+            "/ingest_items?on_conflict=doc_url",
+            headers=PREFER_MERGE_REPRESENTATION,
+            content=json_dumps(payload),
+        )
+        r.raise_for_status()
+        data = json_loads(r.content)
+        return data[0] if data else {}
+
+    def bulk_upsert_ingest_items(self, payloads: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        # one POST for the whole array; representations come back with ids
+        if not payloads:
+            return []
+        r = self._client.post(
+            "/ingest_items?on_conflict=doc_url",
+            headers=PREFER_MERGE_REPRESENTATION,
+            content=json_dumps(payloads),
+        )
+        r.raise_for_status()
+        return json_loads(r.content)
 
     def set_ingest_item_status(self, doc_url: str, status: str, *, error: str | None = None, extra: dict[str, Any] | None = None) -> None:
         patch: dict[str, Any] = {"status": status}
@@ -54,30 +141,71 @@ class SupabaseStore:
         if extra:
             patch.update(extra)
 
-        # Escape doc_url by passing as param-ish: simplest is eq.<urlencoded>
-        q = httpx.QueryParams({"doc_url": f"eq.{doc_url}"}).encode()
-        with httpx.Client(timeout=30) as c:
-            r = c.patch(
-                f"{self.rest}/ingest_items?{q}",
-                headers={**self._headers(), "Prefer": "return=minimal"},
-                json=patch,
-            )
-            r.raise_for_status()
+        # PostgREST filter value: eq.<percent-encoded doc_url>
+        q = f"doc_url=eq.{quote(doc_url, safe='')}"
+        r = self._client.patch(
+            f"/ingest_items?{q}",
+            headers=PREFER_MINIMAL,
+            content=json_dumps(patch),
+        )
+        r.raise_for_status()
 
     def get_regulation_by_doc_url(self, doc_url: str) -> dict[str, Any] | None:
-        q = httpx.QueryParams({"doc_url": f"eq.{doc_url}", "select": "*", "limit": "1"}).encode()
-        with httpx.Client(timeout=30) as c:
-            r = c.get(f"{self.rest}/regulations?{q}", headers=self._headers())
-            r.raise_for_status()
-            data = r.json()
-            return data[0] if data else None
+        if f"url:{doc_url}" not in self._seen():
+            return None
+        q = f"doc_url=eq.{quote(doc_url, safe='')}&select=*&limit=1"
+        r = self._client.get(f"/regulations?{q}")
+        r.raise_for_status()
+        data = json_loads(r.content)
+        return data[0] if data else None
+
+    def get_regulation_by_content_hash(self, content_hash: str) -> dict[str, Any] | None:
+        if f"hash:{content_hash}" not in self._seen():
+            return None
+        params = {"content_hash": f"eq.{content_hash}", "select": "*", "limit": "1"}
+        r = self._client.get("/regulations", params=params)
+        r.raise_for_status()
+        data = json_loads(r.content)
+        return data[0] if data else None
+
+    def get_regulation_by_pdf_hash(self, pdf_hash: str, *, doc_url: str | None = None) -> dict[str, Any] | None:
+        # doc_url narrows the match to that document's own row
+        if f"pdf:{pdf_hash}" not in self._seen():
+            return None
+        params = {"pdf_hash": f"eq.{pdf_hash}", "select": "*", "limit": "1"}
+        if doc_url is not None:
+            params["doc_url"] = f"eq.{doc_url}"
+        r = self._client.get("/regulations", params=params)
+        r.raise_for_status()
+        data = json_loads(r.content)
+        return data[0] if data else None
+
+    def get_known_doc_urls(self, *, since: timedelta) -> set[str]:
+        # doc_urls of regulations created within the last `since`
+        cutoff = (datetime.now(timezone.utc) - since).isoformat()
+        params = {"select": "doc_url", "created_at": f"gte.{cutoff}"}
+        r = self._client.get("/regulations", params=params)
+        r.raise_for_status()
+        return {row["doc_url"] for row in json_loads(r.content)}
 
     def upsert_regulation(self, payload: dict[str, Any]) -> None:
         # upsert by doc_url (unique)
-        with httpx.Client(timeout=30) as c:
-            r = c.post(
-                f"{self.rest}/regulations?on_conflict=doc_url",
-                headers={**self._headers(), "Prefer": "resolution=merge-duplicates,return=minimal"},
-                json=payload,
-            )
-            r.raise_for_status()
+        r = self._client.post(
+            "/regulations?on_conflict=doc_url",
+            headers=PREFER_MERGE_MINIMAL,
+            content=json_dumps(payload),
+        )
+        r.raise_for_status()
+        self._mark_seen([payload])
+
+    def upsert_regulations(self, rows: list[dict[str, Any]]) -> None:
+        # bulk upsert by doc_url: PostgREST takes a JSON array in one request
+        if not rows:
+            return
+        r = self._client.post(
+            "/regulations?on_conflict=doc_url",
+            headers=PREFER_MERGE_MINIMAL,
+            content=json_dumps(rows),
+        )
+        r.raise_for_status()
+        self._mark_seen(rows)
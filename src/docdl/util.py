@@ -1,8 +1,121 @@
 ﻿from __future__ import annotations
+import asyncio
 import hashlib
+import json
+import math
+import os
+import tempfile
+from typing import Any
 
-def sha256_text(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is used as fallback
+    orjson = None
+
+try:
+    import blake3
+except ImportError:  # optional: only needed for CONTENT_HASH_ALGO=blake3
+    blake3 = None
+
+# content_hash algorithm: "sha256" (default, matches stored hashes) or "blake3"
+CONTENT_HASH_ALGO = os.environ.get("CONTENT_HASH_ALGO", "sha256").lower()
+
+def new_content_hasher():
+    """Incremental hasher for content_hash (hashlib-style update/hexdigest)."""
+    if CONTENT_HASH_ALGO == "blake3":
+        if blake3 is None:
+            raise RuntimeError("CONTENT_HASH_ALGO=blake3 requires the blake3 package")
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    return hashlib.sha256()
+
+def sha256_text(s: str | bytes) -> str:
+    """
+    content_hash of extracted text. Pass the already-encoded UTF-8 bytes when
+    you have them to skip a second copy of a multi-MB string.
+    """
+    h = new_content_hasher()
+    h.update(s.encode("utf-8") if isinstance(s, str) else s)
+    return h.hexdigest()
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
+
+def atomic_write_bytes(path: str | os.PathLike, data: bytes) -> None:
+    """Write data to a temp file next to path, then rename it into place."""
+    d, name = os.path.split(os.fspath(path))
+    fd, tmp = tempfile.mkstemp(dir=d or ".", prefix=name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def json_dumps(obj: Any, *, indent: bool = False) -> bytes:
+    """UTF-8 JSON bytes (non-ASCII kept as-is); indent=True pretty-prints with 2 spaces."""
+    if orjson is not None:
+        # NON_STR_KEYS: coerce int/enum keys like stdlib json instead of raising
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+def json_loads(data: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings: no false negatives, ~error_rate
+    false positives once `capacity` keys are in.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        # double hashing: k positions from the two halves of one digest
+        d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class AsyncTokenBucket:
+    """
+    Token bucket for coroutines: refills `rate_per_s` tokens per second up to
+    `capacity`, and acquire() waits for one. Waiters are served in arrival
+    order (asyncio.Lock is FIFO).
+    """
+
+    def __init__(self, rate_per_s: float, capacity: int = 1):
+        self.rate = max(rate_per_s, 0.1)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated: float | None = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# no package metadata: import docdl straight from src/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+
+@pytest.fixture
+def openai(monkeypatch):
+    """
+    Route docdl.enrich through an httpx.MockTransport. Call the fixture with a
+    handler(request) -> httpx.Response; it returns the list of requests made.
+    Sleeps run on a fake clock (enrich.time.monotonic advances by each sleep)
+    and are recorded in .sleeps.
+    """
+    from docdl import enrich
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", "https://openai.test")
+
+    class Mock:
+        def __init__(self):
+            self.requests: list[httpx.Request] = []
+            self.sleeps: list[float] = []
+            self.now = 0.0
+
+        def __call__(self, handler):
+            def record(request):
+                self.requests.append(request)
+                return handler(request)
+
+            monkeypatch.setattr(enrich, "_client", httpx.Client(transport=httpx.MockTransport(record)))
+            return self.requests
+
+        # stands in for the time module inside docdl.enrich
+        def monotonic(self) -> float:
+            return self.now
+
+        def sleep(self, seconds: float) -> None:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    mock = Mock()
+    monkeypatch.setattr(enrich, "time", mock)
+    return mock
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """SupabaseStore whose .mock(handler) routes it through an httpx.MockTransport."""
+    from docdl.store import SupabaseStore
+
+    monkeypatch.setenv("SUPABASE_URL", "https://supabase.test")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "test")
+    store = SupabaseStore()
+    requests: list[httpx.Request] = []
+
+    def mock(handler):
+        def record(request):
+            requests.append(request)
+            return handler(request)
+
+        store._client = httpx.Client(base_url=store.rest, transport=httpx.MockTransport(record))
+        return requests
+
+    store.mock = mock
+    yield store
+    store.close()
@@ -0,0 +1,68 @@
+import json
+import os
+
+from docdl.config import load_yaml_cached
+
+
+def write_yaml(path, text, mtime_ns=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_first_load_writes_sidecar(tmp_path):
+    cfg = tmp_path / "sources.yaml"
+    write_yaml(cfg, "run:\n  timeout_s: 30\n")
+
+    assert load_yaml_cached(cfg) == {"run": {"timeout_s": 30}}
+    assert json.loads((tmp_path / "sources.yaml.json").read_text()) == {"run": {"timeout_s": 30}}
+
+
+def test_fresh_sidecar_is_used(tmp_path):
+    cfg = tmp_path / "sources.yaml"
+    write_yaml(cfg, "run:\n  timeout_s: 30\n", mtime_ns=1_000_000_000)
+    sidecar = tmp_path / "sources.yaml.json"
+    sidecar.write_text('{"from": "sidecar"}')
+    os.utime(sidecar, ns=(2_000_000_000, 2_000_000_000))
+
+    assert load_yaml_cached(cfg) == {"from": "sidecar"}
+
+
+def test_yaml_newer_than_sidecar_is_reparsed(tmp_path):
+    cfg = tmp_path / "sources.yaml"
+    sidecar = tmp_path / "sources.yaml.json"
+    sidecar.write_text('{"stale": true}')
+    os.utime(sidecar, ns=(1_000_000_000, 1_000_000_000))
+    write_yaml(cfg, "run:\n  timeout_s: 60\n", mtime_ns=2_000_000_000)
+
+    assert load_yaml_cached(cfg) == {"run": {"timeout_s": 60}}
+    assert json.loads(sidecar.read_text()) == {"run": {"timeout_s": 60}}
+
+
+def test_corrupt_sidecar_falls_back_to_yaml(tmp_path):
+    cfg = tmp_path / "sources.yaml"
+    write_yaml(cfg, "a: 1\n", mtime_ns=1_000_000_000)
+    sidecar = tmp_path / "sources.yaml.json"
+    sidecar.write_text('{"a": ')
+    os.utime(sidecar, ns=(2_000_000_000, 2_000_000_000))
+
+    assert load_yaml_cached(cfg) == {"a": 1}
+
+
+def test_non_json_values_skip_the_sidecar(tmp_path):
+    cfg = tmp_path / "sources.yaml"
+    write_yaml(cfg, "since: 2025-10-01\n")
+
+    data = load_yaml_cached(cfg)
+
+    assert str(data["since"]) == "2025-10-01"
+    assert not (tmp_path / "sources.yaml.json").exists()
+
+
+def test_bom_and_non_ascii_round_trip(tmp_path):
+    # config files in this repo start with a UTF-8 BOM
+    cfg = tmp_path / "sources.yaml"
+    cfg.write_bytes("﻿series: Perspectivas económicas – MECA\n".encode("utf-8"))
+
+    assert load_yaml_cached(cfg) == {"series": "Perspectivas económicas – MECA"}
+    assert load_yaml_cached(cfg) == {"series": "Perspectivas económicas – MECA"}  # from the sidecar
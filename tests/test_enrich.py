@@ -0,0 +1,128 @@
+import json
+
+import httpx
+import pytest
+
+from docdl import enrich
+
+
+def test_get_retries_5xx_and_caps_retry_after(openai):
+    responses = iter([
+        httpx.Response(503, headers={"retry-after": "3600"}),
+        httpx.Response(200, json={"status": "in_progress"}),
+    ])
+    requests = openai(lambda req: next(responses))
+
+    r = enrich._request_with_retry("GET", "https://openai.test/v1/batches/b1")
+
+    assert r.status_code == 200
+    assert len(requests) == 2
+    assert openai.sleeps == [enrich.MAX_RETRY_DELAY_S]
+
+
+def test_batch_create_is_not_retried_after_5xx(openai):
+    requests = openai(lambda req: httpx.Response(502))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        enrich._request_with_retry("POST", "https://openai.test/v1/batches", idempotent=False, json={})
+    assert len(requests) == 1
+
+
+def test_batch_create_is_not_retried_after_read_timeout(openai):
+    def handler(req):
+        raise httpx.ReadTimeout("response lost", request=req)
+
+    requests = openai(handler)
+
+    with pytest.raises(httpx.ReadTimeout):
+        enrich._request_with_retry("POST", "https://openai.test/v1/batches", idempotent=False, json={})
+    assert len(requests) == 1
+
+
+def test_batch_create_is_retried_when_never_sent(openai):
+    attempts = []
+
+    def handler(req):
+        attempts.append(req)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("refused", request=req)
+        return httpx.Response(200, json={"id": "batch_1"})
+
+    openai(handler)
+
+    r = enrich._request_with_retry("POST", "https://openai.test/v1/batches", idempotent=False, json={})
+    assert r.json()["id"] == "batch_1"
+    assert len(attempts) == 2
+
+
+def test_submit_batch_posts_file_and_batch_once(openai):
+    def handler(req):
+        if req.url.path == "/v1/files":
+            return httpx.Response(200, json={"id": "file_1"})
+        return httpx.Response(200, json={"id": "batch_1"})
+
+    requests = openai(handler)
+
+    jobs = [{"custom_id": "a", "text": "short text", "title": "T", "source": "iea_gas_reports"}]
+    assert enrich.submit_batch(jobs) == "batch_1"
+    assert [r.url.path for r in requests] == ["/v1/files", "/v1/batches"]
+
+
+def test_submit_batch_rejects_mixed_models(openai):
+    requests = openai(lambda req: httpx.Response(200, json={"id": "x"}))
+    jobs = [
+        {"custom_id": "short", "text": "brief", "title": "T", "source": "imf_reo_meca"},
+        {"custom_id": "long", "text": "x" * enrich.SMALL_MODEL_MAX_CHARS, "title": "T", "source": "imf_reo_meca"},
+    ]
+
+    groups = enrich.group_jobs_by_model(jobs)
+    assert sorted(len(g) for g in groups.values()) == [1, 1]
+    with pytest.raises(ValueError):
+        enrich.submit_batch(jobs)
+    assert requests == []
+
+
+def completion(content, *, finish_reason="stop", refusal=None):
+    message = {"content": content, "refusal": refusal}
+    return {"model": "gpt-4o-mini", "choices": [{"finish_reason": finish_reason, "message": message}]}
+
+
+def batch_line(custom_id, body, status_code=200):
+    return json.dumps({"custom_id": custom_id, "response": {"status_code": status_code, "body": body}})
+
+
+def test_poll_batch_keeps_good_lines(openai):
+    output = "\n".join([
+        batch_line("ok", completion('{"summary": "fine"}')),
+        batch_line("refused", completion(None, refusal="no")),
+        batch_line("truncated", completion('{"summ', finish_reason="length")),
+        batch_line("server_error", {"error": "boom"}, status_code=500),
+        batch_line("bad_json", completion("not json")),
+        "{not even json",
+        "",
+    ])
+
+    def handler(req):
+        if req.url.path == "/v1/batches/b1":
+            return httpx.Response(200, json={"status": "completed", "output_file_id": "f1"})
+        return httpx.Response(200, text=output)
+
+    openai(handler)
+
+    assert enrich.poll_batch("b1") == {"ok": {"summary": "fine", "model": "gpt-4o-mini"}}
+
+
+@pytest.mark.parametrize("status", ["failed", "expired", "cancelled"])
+def test_poll_batch_terminal_status_raises_failed(openai, status):
+    openai(lambda req: httpx.Response(200, json={"status": status}))
+
+    with pytest.raises(enrich.BatchFailedError):
+        enrich.poll_batch("b1")
+
+
+def test_poll_batch_timeout_raises_pending(openai):
+    openai(lambda req: httpx.Response(200, json={"status": "in_progress"}))
+
+    with pytest.raises(enrich.BatchPendingError) as exc:
+        enrich.poll_batch("b1", timeout_s=0)
+    assert exc.value.batch_id == "b1"
@@ -0,0 +1,56 @@
+import fitz
+import pytest
+
+from docdl.extract import extract_text_from_pdf, extract_text_to_file, read_extracted_text
+from docdl.util import sha256_text
+
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+CASES = {
+    "plain": ["first page", "second page", "third page"],
+    "leading_blank": ["", "", "body after blanks", "more"],
+    "trailing_blank": ["body", "tail", "", ""],
+    "blank_between": ["one", "", "", "two"],
+    "all_blank": ["", "", ""],
+}
+
+
+@pytest.mark.parametrize("suffix", [".txt", ".txt.lz4"])
+@pytest.mark.parametrize("max_chars", [None, 5])
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_extract_to_file_matches_in_memory(tmp_path, case, max_chars, suffix):
+    if suffix.endswith(".lz4"):
+        pytest.importorskip("lz4")
+    pdf = make_pdf(tmp_path / "doc.pdf", CASES[case])
+    text_path = tmp_path / f"doc{suffix}"
+
+    content_hash, length = extract_text_to_file(pdf, text_path, max_chars)
+    expected = extract_text_from_pdf(pdf, max_chars)
+
+    assert read_extracted_text(text_path) == expected
+    assert content_hash == sha256_text(expected)
+    assert length == len(expected)
+
+
+def test_max_chars_stops_loading_pages(tmp_path):
+    pdf = make_pdf(tmp_path / "doc.pdf", ["a" * 20, "b" * 20, "c" * 20])
+    text = extract_text_from_pdf(pdf, max_chars=25)
+    assert "b" in text
+    assert "c" not in text
+
+
+def test_read_extracted_text_prefix(tmp_path):
+    pdf = make_pdf(tmp_path / "doc.pdf", ["abcdefghij"])
+    text_path = tmp_path / "doc.txt"
+    extract_text_to_file(pdf, text_path)
+    assert read_extracted_text(text_path, max_chars=4) == "abcd"
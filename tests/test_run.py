@@ -0,0 +1,317 @@
+import asyncio
+import json
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fitz
+import httpx
+import pytest
+
+from docdl import run
+from docdl.store import SupabaseStore
+
+REPO = Path(__file__).resolve().parents[1]
+
+SUMMARY = {
+    "summary": "s", "key_points": [], "key_numbers": [], "topics": [], "countries": [],
+    "dates": {"published": None, "horizon": None}, "impact_level": "low", "confidence": 0.5,
+}
+
+
+def make_pdf(text: str, pages: int = 1) -> bytes:
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page().insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=6)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def completion(content: dict) -> dict:
+    return {"model": "mock", "choices": [{"finish_reason": "stop", "message": {"content": json.dumps(content)}}]}
+
+
+class Pipeline:
+    """
+    One IMF issue and one IEA report served through httpx.MockTransport,
+    with Supabase and OpenAI mocked the same way. run() drives run._run.
+    """
+
+    def __init__(self, tmp_path, monkeypatch, openai):
+        self.tmp_path = tmp_path
+        self.pdfs = {"reo.pdf": make_pdf("imf outlook"), "gas-a.pdf": make_pdf("iea gas")}
+        self.batch_status = "completed"
+        self.poll_error: Exception | None = None
+        self.supabase: list[httpx.Request] = []
+        self.batches: dict[str, list[dict]] = {}  # batch_id -> request lines
+        self._files: dict[str, list[dict]] = {}
+
+        shutil.copytree(REPO / "config", tmp_path / "config")
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("SUPABASE_URL", "https://supabase.test")
+        monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "test")
+        # extraction in threads: no worker processes to start per test
+        monkeypatch.setattr(run, "_pdf_pool", ThreadPoolExecutor(2))
+
+        real_async_client = httpx.AsyncClient
+
+        def async_client(**kwargs):
+            return real_async_client(transport=httpx.MockTransport(self.web), **kwargs)
+
+        monkeypatch.setattr(run.httpx, "AsyncClient", async_client)
+        self.openai_requests = openai(self.openai)
+
+    @property
+    def cache_dir(self) -> Path:
+        return self.tmp_path / "data" / "enriched" / ".cache"
+
+    def web(self, req: httpx.Request) -> httpx.Response:
+        path = req.url.path
+        if path == "/en/publications/reo/meca":
+            return httpx.Response(200, html='<a href="/en/publications/reo/meca/issues/2025/10/x">Oct 2025</a>')
+        if "/issues/" in path:
+            return httpx.Response(200, html='<a href="/-/media/files/reo.pdf">Download</a>')
+        if path == "/analysis":
+            return httpx.Response(200, html='<a href="/reports/gas-a">Gas A</a>')
+        if path.startswith("/reports/"):
+            return httpx.Response(200, html='<a href="https://blob.test/gas-a.pdf">Download PDF</a>')
+        name = path.rsplit("/", 1)[-1]
+        if name in self.pdfs:
+            return httpx.Response(200, headers={"content-type": "application/pdf"}, content=self.pdfs[name])
+        return httpx.Response(404)
+
+    def supabase_handler(self, req: httpx.Request) -> httpx.Response:
+        self.supabase.append(req)
+        if req.method == "POST" and req.url.path.endswith("/ingest_items"):
+            rows = json.loads(req.content)
+            return httpx.Response(201, json=[{"id": i + 1, **row} for i, row in enumerate(rows)])
+        if req.method == "GET":
+            return httpx.Response(200, json=[])
+        return httpx.Response(204)
+
+    def openai(self, req: httpx.Request) -> httpx.Response:
+        path = req.url.path
+        if path == "/v1/chat/completions":
+            return httpx.Response(200, json=completion(SUMMARY))
+        if path == "/v1/files":
+            file_id = f"file_{len(self._files)}"
+            self._files[file_id] = [
+                json.loads(line) for line in req.content.split(b"\n") if line.startswith(b'{"custom_id"')
+            ]
+            return httpx.Response(200, json={"id": file_id})
+        if path == "/v1/batches":
+            batch_id = f"batch_{len(self.batches)}"
+            self.batches[batch_id] = self._files[json.loads(req.content)["input_file_id"]]
+            return httpx.Response(200, json={"id": batch_id})
+        if path.startswith("/v1/batches/"):
+            if self.poll_error is not None:
+                raise self.poll_error
+            batch_id = path.rsplit("/", 1)[-1]
+            return httpx.Response(200, json={"status": self.batch_status, "output_file_id": f"out_{batch_id}"})
+        if path.endswith("/content"):
+            batch_id = path.split("/")[-2][len("out_"):]
+            return httpx.Response(200, text="\n".join(
+                json.dumps({"custom_id": line["custom_id"], "response": {"status_code": 200, "body": completion(SUMMARY)}})
+                for line in self.batches[batch_id]
+            ))
+        return httpx.Response(404)
+
+    def run(self, **kwargs) -> dict:
+        store = SupabaseStore()
+        store._client = httpx.Client(base_url=store.rest, transport=httpx.MockTransport(self.supabase_handler))
+        try:
+            asyncio.run(run._run(store, **kwargs))
+        finally:
+            store.close()
+        summary = next((self.tmp_path / "data" / "logs").glob("*.summary.json"))
+        return json.loads(summary.read_text())["counts"]
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch, openai):
+    return Pipeline(tmp_path, monkeypatch, openai)
+
+
+def test_import_starts_no_pool_or_client():
+    # worker processes re-import this module: it must not build anything
+    code = (
+        "import docdl.run, docdl.enrich; "
+        "assert docdl.run._pdf_pool is None; assert docdl.enrich._client is None"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=REPO / "src")
+
+
+def test_read_enrich_cache(tmp_path):
+    path = tmp_path / "abc.json"
+    assert run.read_enrich_cache(str(path)) is None
+
+    path.write_text('{"summary": "s"}')
+    assert run.read_enrich_cache(str(path)) == {"summary": "s"}
+
+
+@pytest.mark.parametrize("content", [b'{"summary": "trunc', b"", b"[1, 2]", b"\xff\xfe"])
+def test_corrupt_enrich_cache_is_a_miss_and_removed(tmp_path, content):
+    path = tmp_path / "abc.json"
+    path.write_bytes(content)
+
+    assert run.read_enrich_cache(str(path)) is None
+    assert not path.exists()
+
+
+def test_status_updater_patches_once_per_item_at_terminal_status(tmp_path, store):
+    patches = []
+
+    def handler(req):
+        patches.append((req.url.params["doc_url"], json.loads(req.content)))
+        return httpx.Response(204)
+
+    store.mock(handler)
+    journal = tmp_path / "items.jsonl"
+    updater = run.StatusUpdater(store, journal)
+    updater.start()
+
+    updater.post("https://a", "discovered", extra={"pdf_url": "https://a.pdf"})
+    updater.post("https://a", "downloaded")
+    updater.post("https://a", "extracted", extra={"content_hash": "h"})
+    updater.post("https://b", "discovered")
+    updater.post("https://a", "stored")
+    updater.post("https://b", "skipped_paywall", error="html")
+    updater.close()
+
+    assert patches == [
+        ("eq.https://a", {"status": "stored", "pdf_url": "https://a.pdf", "content_hash": "h"}),
+        ("eq.https://b", {"status": "skipped_paywall", "error": "html"}),
+    ]
+    assert [json.loads(line)["status"] for line in journal.read_text().splitlines()] == [
+        "discovered", "downloaded", "extracted", "discovered", "stored", "skipped_paywall",
+    ]
+    assert updater.errors == []
+
+
+def test_status_updater_collects_patch_errors(tmp_path, store):
+    store.mock(lambda req: httpx.Response(500))
+    updater = run.StatusUpdater(store, tmp_path / "items.jsonl")
+    updater.start()
+
+    updater.post("https://a", "failed", error="boom")
+    updater.close()
+
+    assert [(e["doc_url"], e["status"]) for e in updater.errors] == [("https://a", "failed")]
+
+
+def test_resume_pending_batches(tmp_path, openai):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    path = cache_dir / "pending_batches.json"
+    path.write_text(json.dumps({
+        "b_done": {"iea_a": "hash_a"},
+        "b_running": {"iea_b": "hash_b"},
+        "b_failed": {"iea_c": "hash_c"},
+        "b_unreachable": {"iea_d": "hash_d"},
+    }))
+    completion = {"model": "m", "choices": [{"finish_reason": "stop", "message": {"content": '{"summary": "a"}'}}]}
+
+    def handler(req):
+        batch_id = req.url.path.rsplit("/", 1)[-1]
+        if batch_id == "b_done":
+            return httpx.Response(200, json={"status": "completed", "output_file_id": "f_done"})
+        if batch_id == "b_running":
+            return httpx.Response(200, json={"status": "in_progress"})
+        if batch_id == "b_failed":
+            return httpx.Response(200, json={"status": "expired"})
+        if batch_id == "b_unreachable":
+            raise httpx.ConnectError("network down", request=req)
+        line = {"custom_id": "iea_a", "response": {"status_code": 200, "body": completion}}
+        return httpx.Response(200, text=json.dumps(line))
+
+    openai(handler)
+
+    pending_hashes, errors = run.resume_pending_batches(path, str(cache_dir))
+
+    assert json.loads((cache_dir / "hash_a.json").read_text())["summary"] == "a"
+    # still running or unreachable: kept for the next run
+    assert json.loads(path.read_text()) == {"b_running": {"iea_b": "hash_b"}, "b_unreachable": {"iea_d": "hash_d"}}
+    assert pending_hashes == {"hash_b", "hash_d"}
+    assert sorted(e["batch_id"] for e in errors) == ["b_failed", "b_unreachable"]
+
+
+def test_resume_pending_batches_without_file(tmp_path, openai):
+    requests = openai(lambda req: httpx.Response(500))
+
+    assert run.resume_pending_batches(tmp_path / "pending_batches.json", str(tmp_path)) == (set(), [])
+    assert requests == []
+
+
+def test_batch_run_caches_results(pipeline):
+    counts = pipeline.run()
+
+    assert counts["processed"] == 2
+    # one ingest_items PATCH per item, at its terminal status
+    item_patches = [r for r in pipeline.supabase if r.method == "PATCH" and r.url.path.endswith("/ingest_items")]
+    assert sorted(json.loads(r.content)["status"] for r in item_patches) == ["stored", "stored"]
+    assert len(pipeline.batches) == 1
+    assert len(list(pipeline.cache_dir.glob("*.json"))) == 2
+
+
+def test_realtime_run_caches_results(pipeline):
+    counts = pipeline.run(realtime=True)
+
+    assert counts["processed"] == 2
+    assert pipeline.batches == {}
+    assert len(list(pipeline.cache_dir.glob("*.json"))) == 2
+
+    # second run: both documents come from the cache, no completions
+    for summary in (pipeline.tmp_path / "data" / "logs").glob("*.summary.json"):
+        summary.unlink()
+    completions = len(pipeline.openai_requests)
+    assert pipeline.run(realtime=True)["enrich_cached"] == 2
+    assert len(pipeline.openai_requests) == completions
+
+
+def long_report() -> bytes:
+    # past SMALL_MODEL_MAX_CHARS, so the IMF report goes to the large model
+    return make_pdf("regional outlook growth inflation " * 300, pages=6)
+
+
+def test_batch_run_submits_one_batch_per_model(pipeline):
+    pipeline.pdfs["reo.pdf"] = long_report()
+
+    counts = pipeline.run()
+
+    models = [{line["body"]["model"] for line in lines} for lines in pipeline.batches.values()]
+    assert len(models) == 2
+    assert all(len(m) == 1 for m in models)
+    assert counts["processed"] == 2
+
+
+def test_each_unfinished_batch_is_kept_separately(pipeline):
+    pipeline.pdfs["reo.pdf"] = long_report()
+    pipeline.batch_status = "in_progress"
+
+    pipeline.run()
+
+    pending = json.loads((pipeline.cache_dir / "pending_batches.json").read_text())
+    assert sorted(pending) == ["batch_0", "batch_1"]
+    assert [len(hashes) for hashes in pending.values()] == [1, 1]
+
+
+def test_batch_kept_when_polling_fails_after_submit(pipeline):
+    pipeline.poll_error = httpx.ConnectError("network down")
+
+    counts = pipeline.run()
+
+    pending = json.loads((pipeline.cache_dir / "pending_batches.json").read_text())
+    assert list(pending) == ["batch_0"]
+    assert len(pending["batch_0"]) == 2
+    assert counts["processed"] == 0
+
+
+def test_failed_batch_is_not_kept(pipeline):
+    pipeline.batch_status = "expired"
+
+    pipeline.run()
+
+    assert not (pipeline.cache_dir / "pending_batches.json").exists()
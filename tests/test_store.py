@@ -0,0 +1,35 @@
+import httpx
+
+ROW = {"doc_url": "https://example.org/a", "content_hash": "h1", "pdf_hash": "p1"}
+
+
+def test_upsert_regulations_does_not_seed_the_filter(store):
+    def handler(req):
+        if req.method == "GET":
+            return httpx.Response(503)
+        return httpx.Response(201)
+
+    requests = store.mock(handler)
+
+    store.upsert_regulations([ROW])  # seeding would hit the 503
+
+    assert [r.method for r in requests] == ["POST"]
+
+
+def test_upsert_after_seed_marks_rows_seen(store):
+    def handler(req):
+        if req.method == "GET" and req.url.params.get("offset") not in (None, "0"):
+            return httpx.Response(200, json=[])
+        if req.method == "GET" and "content_hash" in req.url.params:
+            return httpx.Response(200, json=[ROW])
+        if req.method == "GET":
+            return httpx.Response(200, json=[])
+        return httpx.Response(201)
+
+    requests = store.mock(handler)
+
+    assert store.get_regulation_by_content_hash("h1") is None  # seeds empty: no query
+    n = len(requests)
+    store.upsert_regulations([ROW])
+    assert store.get_regulation_by_content_hash("h1") == ROW
+    assert len(requests) == n + 2
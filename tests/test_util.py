@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from docdl.util import AsyncTokenBucket, BloomFilter, atomic_write_bytes
+
+
+def test_bloom_has_no_false_negatives():
+    bloom = BloomFilter(capacity=5_000, error_rate=0.01)
+    keys = [f"url:https://example.org/{i}" for i in range(5_000)]
+    for k in keys:
+        bloom.add(k)
+    assert all(k in bloom for k in keys)
+
+
+def test_bloom_false_positive_rate_at_capacity():
+    bloom = BloomFilter(capacity=5_000, error_rate=0.01)
+    for i in range(5_000):
+        bloom.add(f"in:{i}")
+    probes = 20_000
+    hits = sum(f"out:{i}" in bloom for i in range(probes))
+    # 3x headroom over the configured rate keeps this from flaking
+    assert hits / probes < 0.03
+
+
+def test_token_bucket_burst_then_rate():
+    async def go():
+        loop = asyncio.get_running_loop()
+        bucket = AsyncTokenBucket(rate_per_s=20, capacity=5)
+        start = loop.time()
+        for _ in range(5):
+            await bucket.acquire()
+        burst = loop.time() - start
+        for _ in range(10):
+            await bucket.acquire()
+        return burst, loop.time() - start
+
+    burst, total = asyncio.run(go())
+    assert burst < 0.05
+    # 10 tokens past the burst at 20/s
+    assert 0.45 <= total < 1.0
+
+
+def test_token_bucket_shared_by_concurrent_waiters():
+    async def go():
+        loop = asyncio.get_running_loop()
+        bucket = AsyncTokenBucket(rate_per_s=20, capacity=1)
+        start = loop.time()
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+        return loop.time() - start
+
+    # one shared rate, not 20/s per waiter
+    assert asyncio.run(go()) >= 0.45
+
+
+def test_atomic_write_replaces_whole_file(tmp_path):
+    path = tmp_path / "entry.json"
+    path.write_bytes(b"old contents, longer than the new ones")
+
+    atomic_write_bytes(path, b"new")
+
+    assert path.read_bytes() == b"new"
+    assert [p.name for p in tmp_path.iterdir()] == ["entry.json"]
+
+
+def test_atomic_write_failure_keeps_old_file(tmp_path, monkeypatch):
+    path = tmp_path / "entry.json"
+    path.write_bytes(b"old")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("docdl.util.os.replace", fail)
+    with pytest.raises(OSError):
+        atomic_write_bytes(path, b"new")
+
+    assert path.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["entry.json"]